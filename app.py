@@ -1,16 +1,35 @@
+import os
+import glob
 import streamlit as st
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib import font_manager
+from matplotlib.figure import Figure
 from logic import (
     load_source, import_uploaded_csv, years, leagues, teams,
     filter_table, team_trend, snapshot_to_db, load_db
 )
+from palette import LEAGUE_COLORS, DEFAULT_COLOR
 
 
 # ===== 見た目設定 =====
-matplotlib.rcParams["font.family"] = ["MS Gothic", "Yu Gothic", "Meiryo", "sans-serif"]
+FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
+FALLBACK_FONTS = ["MS Gothic", "Yu Gothic", "Meiryo", "sans-serif"]
+
+@st.cache_resource(show_spinner=False)
+def _init_fonts():
+    # fonts/ 以下（例: fonts/ipaexg00401/ipaexg.ttf）の日本語フォントを一度だけ登録する
+    names = []
+    for path in sorted(glob.glob(os.path.join(FONT_DIR, "**", "*.[ot]tf"), recursive=True)):
+        font_manager.fontManager.addfont(path)
+        names.append(font_manager.FontProperties(fname=path).get_name())
+    matplotlib.rcParams["font.family"] = names[:1] + FALLBACK_FONTS
+    return names[0] if names else None
+
 st.set_page_config(page_title="NPB 成績分析アプリ", layout="wide")
+_init_fonts()
 
 st.title("NPB 成績分析アプリ")
 st.caption("年度・リーグ・チームでフィルタして、勝率を表とグラフで可視化。必要な結果はCSVに保存できます。")
@@ -38,84 +57,102 @@ with st.sidebar:
     show_labels = st.checkbox("棒グラフに数値ラベル", value=True)
     use_percent = st.checkbox("勝率を%表記にする", value=True)
     st.divider()
-    if st.button("この一覧をCSVに保存（加点）", use_container_width=True):
-        view_for_save = filter_table(src_df, y, lg, tm)
-        meta = {"year": y, "league": lg, "team": tm}
-        snapshot_to_db(view_for_save, meta)
-        st.success("data/records.csv に保存しました。")
+    save_clicked = st.button("この一覧を履歴に保存（加点）", use_container_width=True)
+
+# ===== 共通のフィルタ済データ（保存・概要タブで共用） =====
+view = filter_table(src_df, y, lg, tm)
+if save_clicked:
+    meta = {"year": y, "league": lg, "team": tm}
+    snapshot_to_db(view, meta)
+    st.sidebar.success("data/records.parquet に保存しました。")
 
 # ===== タブ構成 =====
 tab1, tab2, tab3 = st.tabs(["📊 概要", "📈 チーム推移", "🗂 履歴/データ"])
 
-# ===== 共通のフィルタ済データ =====
-view = filter_table(src_df, y, lg, tm)
-
 # ===== 便利関数 =====
 def fmt_rate(val: float, to_percent: bool) -> str:
     return f"{val*100:.1f}%" if to_percent else f"{val:.3f}"
 
-def bar_colors_by_league(series_league: pd.Series):
-    # セ＝青系 / パ＝緑系 / 全体混在時も対応
-    cmap_se = plt.cm.Blues
-    cmap_pa = plt.cm.Greens
-    colors = []
-    for i, lg in enumerate(series_league):
-        if lg == "セ・リーグ":
-            colors.append(cmap_se(0.6))
-        elif lg == "パ・リーグ":
-            colors.append(cmap_pa(0.6))
-        else:
-            colors.append(plt.cm.Greys(0.6))
-    return colors
+def fmt_rates(vals, to_percent: bool) -> list[str]:
+    # fmt_rate の配列版（ラベル用にまとめて整形）
+    arr = np.asarray(vals, dtype=float)
+    return (np.char.mod("%.1f%%", arr * 100) if to_percent else np.char.mod("%.3f", arr)).tolist()
+
+def bar_colors_by_league(series_league: pd.Series) -> np.ndarray:
+    # 全体混在時も対応。行ループせずマスクで一括代入
+    arr = series_league.to_numpy()
+    out = np.empty((arr.size, 4), dtype=np.float32)
+    out[:] = DEFAULT_COLOR
+    for league, color in LEAGUE_COLORS.items():
+        out[arr == league] = color
+    return out
+
+def session_figure(key: str, figsize: tuple[float, float]) -> Figure:
+    # Figureは再実行ごとに作り直さず、セッション内で使い回す（軸だけ描き直す）
+    if key not in st.session_state:
+        st.session_state[key] = Figure(figsize=figsize)
+    fig = st.session_state[key]
+    fig.clear()
+    return fig
 
 # ===== タブ1：概要 =====
 with tab1:
     # KPIカード
     c1, c2, c3, c4 = st.columns(4)
-    avg_rate = (view["WinRate"].mean()) if not view.empty else 0
-    max_rate = (view["WinRate"].max()) if not view.empty else 0
-    min_rate = (view["WinRate"].min()) if not view.empty else 0
+    # pandas を経由せず NumPy 配列のまま集計する
+    # 欠損（アップロードCSVの空欄など）は Series の集計と同じく除外する
+    rates = view["WinRate"].to_numpy()
+    valid = np.flatnonzero(~np.isnan(rates))
+    if valid.size:
+        avg_rate, max_rate, min_rate = np.nanmean(rates), np.nanmax(rates), np.nanmin(rates)
+    elif rates.size:
+        avg_rate = max_rate = min_rate = np.nan  # 全行欠損なら Series の集計と同じく NaN
+    else:
+        avg_rate = max_rate = min_rate = 0
+    # ラベル文字列は一度だけ作り、KPI・棒ラベル・コメントで使い回す
+    # （view は勝率降順で欠損は末尾なので、有効な先頭・末尾の行が最高・最低）
+    view_labels = fmt_rates(rates, use_percent)
     c1.metric("平均勝率", fmt_rate(avg_rate, use_percent))
-    c2.metric("最高勝率", fmt_rate(max_rate, use_percent))
-    c3.metric("最低勝率", fmt_rate(min_rate, use_percent))
+    c2.metric("最高勝率", view_labels[valid[0]] if valid.size else fmt_rate(max_rate, use_percent))
+    c3.metric("最低勝率", view_labels[valid[-1]] if valid.size else fmt_rate(min_rate, use_percent))
     c4.metric("表示チーム数", len(view))
 
     st.markdown("### 成績表（フィルタ適用後・勝率で降順）")
     if use_percent:
-        view_show = view.copy()
-        view_show["WinRate(%)"] = (view_show["WinRate"] * 100).round(1)
+        # 列の追加・選択はせず、表示名と桁はフロント側の column_config に任せる
+        # （printf形式は値を100倍できないので、WinRate 列だけ差し替える）
         st.dataframe(
-            view_show[["Year","League","Team","Games","Wins","Losses","Draws","WinRate(%)"]],
-            use_container_width=True
+            view.assign(WinRate=rates * 100),
+            use_container_width=True,
+            column_config={"WinRate": st.column_config.NumberColumn("WinRate(%)", format="%.1f")}
         )
     else:
         st.dataframe(view, use_container_width=True)
 
     st.markdown("### 勝率ランキング（バー）")
-    fig, ax = plt.subplots(figsize=(10, 4.2))
-    colors = bar_colors_by_league(view["League"]) if lg == "全体" else plt.cm.viridis(view["WinRate"])
+    fig = session_figure("fig1", (10, 4.2))
+    ax = fig.add_subplot(111)
+    # どちらの分岐も (N, 4) の float32 配列にそろえ、要素ごとの色変換を避ける
+    colors = bar_colors_by_league(view["League"]) if lg == "全体" else plt.cm.viridis(rates).astype(np.float32)
     bars = ax.bar(view["Team"], view["WinRate"], color=colors, edgecolor="white")
 
     # ラベル
     if show_labels:
-        for b, r in zip(bars, view["WinRate"]):
-            ax.text(b.get_x() + b.get_width()/2, r,
-                    fmt_rate(r, use_percent),
-                    ha="center", va="bottom", fontsize=8)
+        ax.bar_label(bars, labels=view_labels, padding=1, fontsize=8)
 
     ax.set_ylabel("勝率(%)" if use_percent else "勝率")
-    ymax = (max(0.8, view["WinRate"].max() + 0.05)) if not view.empty else 1.0
+    ymax = (max(0.8, max_rate + 0.05)) if rates.size else 1.0
     ax.set_ylim(0, ymax)
     ax.tick_params(axis="x", labelrotation=30, labelsize=8)
     ax.grid(axis="y", alpha=0.2)
-    st.pyplot(fig, clear_figure=True)
+    st.pyplot(fig)
 
     # ちょい分析コメント（一言で言える材料）
     if not view.empty:
         top_row = view.iloc[0]
         st.info(
             f"✅ {y}年の{(' ' + lg) if lg != '全体' else ''}で最も高い勝率は "
-            f"**{top_row['Team']}**（{fmt_rate(top_row['WinRate'], use_percent)}）。"
+            f"**{top_row['Team']}**（{view_labels[0]}）。"
         )
     else:
         st.warning("該当データがありません。フィルタ条件を見直してください。")
@@ -129,15 +166,17 @@ with tab2:
     if trend.empty:
         st.warning("データが見つかりません。")
     else:
-        fig2, ax2 = plt.subplots(figsize=(10, 3.8))
+        fig2 = session_figure("fig2", (10, 3.8))
+        ax2 = fig2.add_subplot(111)
         ax2.plot(trend["Year"], trend["WinRate"], marker="o")
-        for x, yv in zip(trend["Year"], trend["WinRate"]):
-            ax2.text(x, yv, fmt_rate(yv, use_percent), ha="center", va="bottom", fontsize=8)
+        # 折れ線には bar_label 相当がないため、ラベル文字列だけまとめて作る
+        for x, yv, label in zip(trend["Year"], trend["WinRate"], fmt_rates(trend["WinRate"], use_percent)):
+            ax2.text(x, yv, label, ha="center", va="bottom", fontsize=8)
         ax2.set_xlabel("年度")
         ax2.set_ylabel("勝率(%)" if use_percent else "勝率")
         ax2.set_ylim(0, max(0.8, trend["WinRate"].max() + 0.05))
         ax2.grid(True, alpha=0.3)
-        st.pyplot(fig2, clear_figure=True)
+        st.pyplot(fig2)
 
         # ひとこと要約
         st.caption(f"→ **{sel_team}** は {trend['Year'].min()}–{trend['Year'].max()} で "
@@ -145,10 +184,10 @@ with tab2:
 
 # ===== タブ3：履歴/データ =====
 with tab3:
-    st.subheader("保存履歴（records.csv）")
+    st.subheader("保存履歴（records.parquet）")
     db = load_db()
     if db is None or db.empty:
-        st.info("まだ保存履歴はありません。サイドバーの『この一覧をCSVに保存』を押すと追記されます。")
+        st.info("まだ保存履歴はありません。サイドバーの『この一覧を履歴に保存』を押すと追記されます。")
     else:
         st.dataframe(db, use_container_width=True)
         st.download_button(
@@ -1,81 +1,193 @@
 from __future__ import annotations
 import os
 import io
+import hashlib
+import numpy as np
 import pandas as pd
-from datetime import datetime
+import streamlit as st
+import time
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 SRC_PATH = os.path.join(DATA_DIR, "npb_stats.csv")
-DB_PATH  = os.path.join(DATA_DIR, "records.csv")
+DB_PATH  = os.path.join(DATA_DIR, "records.parquet")
+LEGACY_DB_PATH = os.path.join(DATA_DIR, "records.csv")  # Parquet移行前の履歴
 
 NEEDED_COLS = ["Year", "League", "Team", "Games", "Wins", "Losses", "Draws", "WinRate"]
+# 読み込み時に型を決めてしまう（件数は小さいので int16、League/Team はカテゴリ型）
+# WinRate は float32 にすると平均の丸めが変わり表示値がずれるので float64 のまま
+SCHEMA = {
+    "Year": "int16", "League": "category", "Team": "category",
+    "Games": "int16", "Wins": "int16", "Losses": "int16", "Draws": "int16",
+    "WinRate": "float64",
+}
+
+def _frame_key(df: pd.DataFrame):
+    """キャッシュ用のキー。読み込み時に付けたトークンがあれば全体ハッシュを省く"""
+    token = df.attrs.get("source_token")
+    if token is None:
+        return int(pd.util.hash_pandas_object(df).sum())
+    return (len(df), tuple(df.columns), token)
+
+_HASH_FUNCS = {pd.DataFrame: _frame_key}
 
 def ensure_dirs() -> None:
     os.makedirs(DATA_DIR, exist_ok=True)
 
+def _read_csv(src) -> pd.DataFrame:
+    # pyarrow エンジンで型付きのまま読む（後段の astype を不要にする）
+    try:
+        df = pd.read_csv(src, engine="pyarrow", dtype=SCHEMA)
+    except pd.errors.IntCastingNaNError:
+        raise ValueError("CSVの数値列に空欄があります（Year/Games/Wins/Losses/Draws は必須）") from None
+    # pyarrow は UTF-8 でない文字列を bytes のまま通すので、ここで弾く（Excel の Shift-JIS 出力など）
+    for c in ["League", "Team"]:
+        if c in df.columns and not all(isinstance(v, str) for v in df[c].cat.categories):
+            raise ValueError(f"CSVの文字コードが不正です（UTF-8で保存してください）: {c}列")
+    return df
+
 def _read_csv_strict(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path)
+    df = _read_csv(path)
     missing = [c for c in NEEDED_COLS if c not in df.columns]
     if missing:
         raise ValueError(f"CSVの列が不足しています: {missing} / 期待: {NEEDED_COLS}")
     return df
 
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """値域を軽く整え、年度昇順・勝率降順に一度だけ並べておく（型は読み込み時に SCHEMA で確定済み）"""
+    df["WinRate"] = df["WinRate"].clip(0, 1)
+    # 安定ソートなので、後段のフィルタ結果も勝率降順のまま保たれる
+    return df.sort_values(["Year", "WinRate"], ascending=[True, False], kind="mergesort").reset_index(drop=True)
+
+@st.cache_resource(show_spinner=False, hash_funcs=_HASH_FUNCS)
+def _index(df: pd.DataFrame) -> dict:
+    """年度→(start, stop)、(年度, リーグ)→行位置、チーム×年度→行位置 を作る（_normalize 済みの表が前提）
+    attrs に載せると派生する表ごとに deepcopy されるので、source_token をキーに別で持つ
+    年度内は勝率順なので、リーグ別は連続区間にならず行位置のリストで持つ"""
+    year_idx: dict[int, tuple[int, int]] = {}
+    yl_idx: dict[tuple[int, str], list[int]] = {}
+    for i, (yr, lg) in enumerate(zip(df["Year"].tolist(), df["League"].tolist())):
+        start, _ = year_idx.get(yr, (i, i))
+        year_idx[yr] = (start, i + 1)
+        yl_idx.setdefault((yr, lg), []).append(i)
+    # チーム×年度 → 行位置（無ければ -1）。推移はこの行を引くだけで済む
+    year_list = sorted(year_idx)
+    codes = df["Team"].cat.codes.to_numpy()
+    year_pos = np.searchsorted(year_list, df["Year"].to_numpy())
+    trend_idx = np.full((len(df["Team"].cat.categories), len(year_list)), -1, dtype=np.int64)
+    valid = codes >= 0
+    trend_idx[codes[valid], year_pos[valid]] = np.flatnonzero(valid)
+    return {"year_idx": year_idx, "yl_idx": yl_idx, "trend_idx": trend_idx}
+
+def _rows_for(df: pd.DataFrame, year: int, league: str | None) -> pd.DataFrame:
+    # 索引から該当行だけを取り出す（全行のブール走査をしない）
+    idx = _index(df)
+    if league:
+        return df.iloc[idx["yl_idx"].get((year, league), [])]
+    start, stop = idx["year_idx"].get(year, (0, 0))
+    return df.iloc[start:stop]
+
+def _for_display(q: pd.DataFrame) -> pd.DataFrame:
+    # 画面用の表は連番に振り直し、読み込み元のトークン（attrs）は引き継がない
+    out = q.reset_index(drop=True)
+    out.attrs = {}
+    return out
+
+@st.cache_data(show_spinner=False)
+def _read_source(mtime: float) -> pd.DataFrame:
+    # mtime をキーにして、CSVが差し替えられたら読み直す
+    df = _normalize(_read_csv_strict(SRC_PATH).copy())
+    # 同じ行数のまま中身が差し替わっても別キーになるよう、更新時刻も含める
+    df.attrs["source_token"] = ("src", SRC_PATH, mtime)
+    return df
+
 def load_source() -> pd.DataFrame:
     """元データを読み込み、型と値域を軽く整える"""
     ensure_dirs()
-    df = _read_csv_strict(SRC_PATH).copy()
-    df["Year"]   = df["Year"].astype(int)
-    for c in ["Games","Wins","Losses","Draws"]:
-        df[c] = df[c].astype(int)
-    df["WinRate"] = df["WinRate"].astype(float).clip(0, 1)
-    return df
+    return _read_source(os.path.getmtime(SRC_PATH))
 
+@st.cache_data(show_spinner=False)
 def import_uploaded_csv(bytes_obj: bytes) -> pd.DataFrame:
-    """アップロードCSVをバリデーションして返す（保存はしない）"""
+    """アップロードCSVをバリデーションして返す（保存はしない）
+    同じ内容のアップロードはバイト列のハッシュでキャッシュされる"""
     with io.BytesIO(bytes_obj) as f:
-        df = pd.read_csv(f)
+        df = _read_csv(f)
     missing = [c for c in NEEDED_COLS if c not in df.columns]
     if missing:
         raise ValueError(f"アップロードCSVの列が不足: {missing}")
+    df = _normalize(df)
+    df.attrs["source_token"] = ("upload", hashlib.sha1(bytes_obj).hexdigest())
     return df
 
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS)
 def years(df: pd.DataFrame) -> list[int]:
     return sorted(df["Year"].unique().tolist(), reverse=True)
 
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS)
 def leagues(df: pd.DataFrame) -> list[str]:
     return sorted(df["League"].unique().tolist())
 
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS)
 def teams(df: pd.DataFrame, year: int | None = None, league: str | None = None) -> list[str]:
-    q = df
-    if year is not None:   q = q[q["Year"] == year]
-    if league:             q = q[q["League"] == league]
-    return sorted(q["Team"].unique().tolist())
+    team = df["Team"]
+    if year is None and not league:
+        # カテゴリは作成時に整列済みなので unique + sort を省ける
+        return team.cat.categories.tolist()
+    if year is not None:
+        codes = _rows_for(df, year, league)["Team"].cat.codes.to_numpy()
+    else:
+        codes = team.cat.codes.to_numpy()[(df["League"] == league).to_numpy()]
+    # 文字列ではなく整数コードで重複を除く（コード順＝カテゴリの並び順）
+    present = np.unique(codes[codes >= 0])
+    return team.cat.categories.take(present).tolist()
 
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS)
 def filter_table(df: pd.DataFrame, year: int, league: str | None, team: str | None) -> pd.DataFrame:
-    q = df[df["Year"] == year].copy()
-    if league and league != "全体":
-        q = q[q["League"] == league]
+    q = _rows_for(df, year, None if league == "全体" else league)
     if team and team != "（全チーム）":
         q = q[q["Team"] == team]
-    return q.sort_values("WinRate", ascending=False).reset_index(drop=True)
+    return _for_display(q)
 
+@st.cache_data(show_spinner=False, hash_funcs=_HASH_FUNCS)
 def team_trend(df: pd.DataFrame, team: str) -> pd.DataFrame:
-    t = df[df["Team"] == team].copy()
-    return t.sort_values("Year").reset_index(drop=True)
+    code = df["Team"].cat.categories.get_indexer([team])[0]
+    pos = _index(df)["trend_idx"][code] if code >= 0 else np.empty(0, dtype=np.int64)
+    # 列は年度昇順なので並べ替え不要
+    return _for_display(df.iloc[pos[pos >= 0]])
 
 def snapshot_to_db(df_view: pd.DataFrame, meta: dict) -> None:
-    """画面に出している表をそのままDB(CSV)に追記（加点用）"""
+    """画面に出している表をそのままDB(Parquet)に追記（加点用）"""
     ensure_dirs()
-    stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    out = df_view.copy()
-    out.insert(0, "_saved_at", stamp)
-    out.insert(1, "_meta", str(meta))
-    if os.path.exists(DB_PATH):
-        out.to_csv(DB_PATH, mode="a", header=False, index=False, encoding="utf-8-sig")
-    else:
-        out.to_csv(DB_PATH, index=False, encoding="utf-8-sig")
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    # 注記列を一度に作って横に連結する（コピー＋insert 2回の列ずらしを避ける）
+    n = len(df_view)
+    meta_df = pd.DataFrame({"_saved_at": [stamp] * n, "_meta": [str(meta)] * n}, index=df_view.index)
+    out = pd.concat([meta_df, df_view], axis=1, copy=False)
+    path = _db_source()
+    if path is not None:
+        out = pd.concat([_read_db_file(path), out], ignore_index=True)
+    out.to_parquet(DB_PATH, index=False, compression="zstd")
+    _read_db.clear()
+
+def _db_source() -> str | None:
+    # Parquetが無ければ移行前のCSV履歴を読む（初回保存時にParquetへ取り込まれる）
+    for path in (DB_PATH, LEGACY_DB_PATH):
+        if os.path.exists(path):
+            return path
+    return None
+
+def _read_db_file(path: str) -> pd.DataFrame:
+    # DB_PATH ならParquet、それ以外は移行前のCSV履歴
+    if path == DB_PATH:
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+@st.cache_data(show_spinner=False)
+def _read_db(path: str, mtime: float) -> pd.DataFrame:
+    # パスと mtime をキーにして、追記・移行されたら読み直す
+    return _read_db_file(path)
 
 def load_db() -> pd.DataFrame:
-    if not os.path.exists(DB_PATH):
+    path = _db_source()
+    if path is None:
         return pd.DataFrame()
-    return pd.read_csv(DB_PATH)
\ No newline at end of file
+    return _read_db(path, os.path.getmtime(path))
@@ -0,0 +1,9 @@
+import matplotlib.pyplot as plt
+
+# セ＝青系 / パ＝緑系 / それ以外＝グレー
+# app.py は操作のたびに再実行されるが、import されたモジュールはプロセスで一度だけ評価される
+LEAGUE_COLORS = {
+    "セ・リーグ": tuple(plt.cm.Blues(0.6)),
+    "パ・リーグ": tuple(plt.cm.Greens(0.6)),
+}
+DEFAULT_COLOR = tuple(plt.cm.Greys(0.6))